@@ -0,0 +1,187 @@
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+METRICS = ("temperature", "humidity", "soil_humidity")
+STATISTICS = ("value", "mean", "min", "max", "rate", "duration")
+OPERATORS = ("above", "below")
+
+
+@dataclass
+class Rule:
+    """
+    Plain snapshot of an AlertRule row, so the engine never holds ORM objects.
+
+    statistic is one of:
+      value    - the raw reading
+      mean     - rolling mean over window_minutes
+      min/max  - rolling min/max over window_minutes
+      rate     - change per hour between the oldest and newest reading in the window
+      duration - fires once the reading has stayed above/below threshold for duration_minutes
+    """
+    id: int
+    metric: str
+    statistic: str
+    operator: str
+    threshold: float
+    window_minutes: int = 10
+    duration_minutes: int = 0
+    debounce_minutes: int = 30
+    name: str = ""
+
+
+class MetricWindow:
+    """
+    Time-based sliding window with O(1) amortized updates.
+    Keeps a running sum for the mean and monotonic deques for min/max.
+    """
+
+    def __init__(self, seconds):
+        self.span = timedelta(seconds=seconds)
+        self.points = deque()
+        self.total = 0.0
+        self.mins = deque()
+        self.maxs = deque()
+
+    def add(self, timestamp, value):
+        self.points.append((timestamp, value))
+        self.total += value
+        while self.mins and self.mins[-1][1] > value:
+            self.mins.pop()
+        self.mins.append((timestamp, value))
+        while self.maxs and self.maxs[-1][1] < value:
+            self.maxs.pop()
+        self.maxs.append((timestamp, value))
+
+        cutoff = timestamp - self.span
+        while self.points and self.points[0][0] < cutoff:
+            old_timestamp, old_value = self.points.popleft()
+            self.total -= old_value
+            if self.mins[0][0] <= old_timestamp:
+                self.mins.popleft()
+            if self.maxs[0][0] <= old_timestamp:
+                self.maxs.popleft()
+
+    def mean(self):
+        return self.total / len(self.points) if self.points else None
+
+    def min(self):
+        return self.mins[0][1] if self.mins else None
+
+    def max(self):
+        return self.maxs[0][1] if self.maxs else None
+
+    def rate(self):
+        """Change per hour across the window, None until there are two readings."""
+        if len(self.points) < 2:
+            return None
+        (first_ts, first_value), (last_ts, last_value) = self.points[0], self.points[-1]
+        hours = (last_ts - first_ts).total_seconds() / 3600
+        return (last_value - first_value) / hours if hours > 0 else None
+
+
+@dataclass
+class RuleState:
+    active: bool = False
+    last_fired: datetime = None
+    condition_since: datetime = None
+
+
+@dataclass
+class UserState:
+    rules: list
+    windows: dict = field(default_factory=dict)
+    rule_states: dict = field(default_factory=dict)
+
+
+class AlertEngine:
+    """
+    Evaluates alert rules incrementally as readings are ingested.
+    State is kept per user; call load() to (re)build it from recent history
+    and reset() whenever the user's rules change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+
+    @staticmethod
+    def history_span(rules):
+        """How far back history must be replayed to rebuild state for these rules."""
+        minutes = [max(r.window_minutes, r.duration_minutes) for r in rules]
+        return timedelta(minutes=max(minutes, default=0))
+
+    def is_loaded(self, user_id):
+        return user_id in self._users
+
+    def reset(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def load(self, user_id, rules, history=(), last_fired=None):
+        """
+        Builds state for a user by replaying history (oldest first) without firing.
+        history yields (timestamp, reading) where reading maps metric -> value.
+        last_fired maps rule id -> timestamp of its most recent persisted alert.
+        """
+        state = UserState(rules=list(rules))
+        for rule in state.rules:
+            state.windows.setdefault((rule.metric, rule.window_minutes), MetricWindow(rule.window_minutes * 60))
+            state.rule_states[rule.id] = RuleState(last_fired=(last_fired or {}).get(rule.id))
+        for timestamp, reading in history:
+            self._evaluate(state, timestamp, reading, fire=False)
+        with self._lock:
+            self._users[user_id] = state
+
+    def evaluate(self, user_id, timestamp, reading):
+        """Feeds one reading and returns [(rule, value)] for every rule that fired."""
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                return []
+            return self._evaluate(state, timestamp, reading, fire=True)
+
+    def _evaluate(self, state, timestamp, reading, fire):
+        for (metric, _), window in state.windows.items():
+            if reading.get(metric) is not None:
+                window.add(timestamp, reading[metric])
+
+        fired = []
+        for rule in state.rules:
+            value = reading.get(rule.metric)
+            if value is None:
+                continue
+            rs = state.rule_states[rule.id]
+            window = state.windows[(rule.metric, rule.window_minutes)]
+
+            if rule.statistic == "duration":
+                if _compare(value, rule.operator, rule.threshold):
+                    rs.condition_since = rs.condition_since or timestamp
+                else:
+                    rs.condition_since = None
+                met = rs.condition_since is not None and \
+                    timestamp - rs.condition_since >= timedelta(minutes=rule.duration_minutes)
+            else:
+                if rule.statistic == "value":
+                    stat = value
+                else:
+                    stat = getattr(window, rule.statistic)()
+                if stat is None:
+                    continue
+                value = stat
+                met = _compare(stat, rule.operator, rule.threshold)
+
+            # Fire only on the transition into the alerting condition, at most once per debounce period
+            if met and not rs.active:
+                debounced = rs.last_fired is not None and \
+                    timestamp - rs.last_fired < timedelta(minutes=rule.debounce_minutes)
+                if fire and not debounced:
+                    rs.last_fired = timestamp
+                    fired.append((rule, value))
+            rs.active = met
+        return fired
+
+
+def _compare(value, operator, threshold):
+    return value > threshold if operator == "above" else value < threshold
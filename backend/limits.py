@@ -0,0 +1,86 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """
+    Per-key token buckets refilled at rate_per_minute, holding at most burst tokens.
+    Callers should map unvalidated keys to one shared key; as a backstop at most
+    max_keys buckets are kept, evicting the least recently used. Each check is O(1)
+    under a short lock.
+    """
+
+    def __init__(self, rate_per_minute, burst, max_keys=10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.limited = 0
+        self.evicted = 0
+
+    def acquire(self, key):
+        """Takes a token for key. Returns 0 if admitted, otherwise seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.popitem(last=False)
+                    self.evicted += 1
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                self._buckets.move_to_end(key)
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                self.admitted += 1
+                return 0
+            bucket[0] = tokens
+            self.limited += 1
+            return (1 - tokens) / self.rate
+
+    def stats(self):
+        return {"admitted": self.admitted, "limited": self.limited, "evicted": self.evicted,
+                "tracked_keys": len(self._buckets)}
+
+
+class ConcurrencyLimiter:
+    """
+    Caps how many requests run a section at once; extra requests are shed instead of queued.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+
+    def try_acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.shed += 1
+            return False
+        with self._lock:
+            self.in_flight += 1
+            self.admitted += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {"limit": self.limit, "in_flight": self.in_flight, "admitted": self.admitted, "shed": self.shed}
+
+
+def retry_after(seconds):
+    """Formats a wait as a Retry-After header value (whole seconds, at least 1)."""
+    return str(max(1, math.ceil(seconds)))
@@ -128,5 +128,46 @@ def migrate_database():
         
         print("Migration complete!")
 
+def split_into_shards():
+    """
+    Copies each user's pictures, sensor data and alerts from data.db into
+    their shard database, for switching an existing install to SHARD_BY_USER=1.
+    Aborts without copying if any shard already has rows, so it is safe to re-run.
+    The rows are left in data.db; drop those tables once the copy is verified.
+    """
+    import server
+
+    with server.app.app_context():
+        user_ids = [user_id for (user_id,) in server.db.session.query(server.User.id).all()]
+        tables = [t for t in server.db.metadata.sorted_tables if t.name in server.SHARDED_TABLES]
+        # Refuse to run over shards that already hold data, before copying anything
+        for user_id in user_ids:
+            shard = server.get_shard_engine(user_id)
+            with shard.connect() as shard_conn:
+                for table in tables:
+                    if shard_conn.execute(server.func.count().select().select_from(table)).scalar():
+                        print(f"Shard for user {user_id} already has {table.name} rows, aborting (was it already split?)")
+                        return
+
+        with server.db.engine.connect() as conn:
+            existing = set(server.inspect(conn).get_table_names())
+            for user_id in user_ids:
+                print(f"Copying data for user {user_id}...")
+                shard = server.get_shard_engine(user_id)
+                with shard.begin() as shard_conn:
+                    for table in tables:
+                        if table.name not in existing:
+                            continue
+                        rows = conn.execute(table.select().where(table.c.user_id == user_id)).mappings().all()
+                        if rows:
+                            shard_conn.execute(table.insert(), [dict(r) for r in rows])
+                        print(f"  {table.name}: {len(rows)} rows")
+
+    print("Shard split complete!")
+
 if __name__ == "__main__":
-    migrate_database()
\ No newline at end of file
+    import sys
+    if sys.argv[1:] == ["shards"]:
+        split_into_shards()
+    else:
+        migrate_database()
\ No newline at end of file
@@ -1,9 +1,17 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_cors import CORS
-import base64, io, json, os
+import base64, bisect, hashlib, io, json, os
 from datetime import datetime, timedelta, timezone
 from PIL import Image
+from sqlalchemy import create_engine, func, inspect
+import alerts, limits, threading
+
+try:
+    import msgpack  # Listed in requirements.txt; format=msgpack answers 501 if it is missing
+except ImportError:
+    msgpack = None
 
 
 app = Flask(__name__)
@@ -12,7 +20,73 @@ CORS(app)
 # Configuration
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///data.db"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db = SQLAlchemy(app)
+# Store each user's pictures, sensor data and alerts in instance/shards/user_<id>.db,
+# leaving only users and keys in data.db (see migration.py for splitting an existing database)
+app.config["SHARD_BY_USER"] = os.environ.get("SHARD_BY_USER") == "1"
+
+# Admission control for device ingest, per API key and for image processing overall
+app.config["PICTURE_UPLOADS_PER_MINUTE"] = int(os.environ.get("PICTURE_UPLOADS_PER_MINUTE", 30))
+app.config["SENSOR_UPLOADS_PER_MINUTE"] = int(os.environ.get("SENSOR_UPLOADS_PER_MINUTE", 10))
+app.config["MAX_CONCURRENT_IMAGE_PROCESSING"] = int(os.environ.get("MAX_CONCURRENT_IMAGE_PROCESSING", 4))
+
+SHARDED_TABLES = {"picture", "sensor_data", "alert_rule", "alert"}
+shard_engines = {}
+shard_engines_lock = threading.Lock()
+
+def get_shard_engine(user_id):
+    """
+    Returns the engine for a user's shard database, creating the file and its tables on first use.
+    """
+    engine = shard_engines.get(user_id)
+    if engine is None:
+        with shard_engines_lock:
+            engine = shard_engines.get(user_id)
+            if engine is None:
+                shard_dir = os.path.join(app.instance_path, "shards")
+                os.makedirs(shard_dir, exist_ok=True)
+                engine = create_engine(f"sqlite:///{os.path.join(shard_dir, f'user_{user_id}.db')}")
+                db.metadata.create_all(engine, tables=[t for t in db.metadata.sorted_tables if t.name in SHARDED_TABLES])
+                shard_engines[user_id] = engine
+    return engine
+
+def archive_shard(user_id):
+    """
+    Disposes a deleted user's shard engine and renames its file out of the way,
+    so a new user that is given the same id starts with an empty shard.
+    """
+    with shard_engines_lock:
+        engine = shard_engines.pop(user_id, None)
+        if engine is not None:
+            engine.dispose()
+        shard_path = os.path.join(app.instance_path, "shards", f"user_{user_id}.db")
+        if os.path.exists(shard_path):
+            archived_path = os.path.join(app.instance_path, "shards",
+                                         f"user_{user_id}.deleted-{datetime.now().strftime('%Y%m%d%H%M%S')}.db")
+            os.rename(shard_path, archived_path)
+
+def use_shard(user_id):
+    """
+    Routes queries on per-user tables to the given user's shard for the rest of the request.
+    """
+    previous = g.get("shard_user_id")
+    g.shard_user_id = user_id
+    if app.config["SHARD_BY_USER"] and previous is not None and previous != user_id:
+        # Primary keys repeat across shards, so drop rows loaded from the previous one
+        for obj in list(db.session.identity_map.values()):
+            if inspect(obj).mapper.local_table.name in SHARDED_TABLES:
+                db.session.expunge(obj)
+
+class ShardedSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and mapper is not None and app.config["SHARD_BY_USER"]:
+            if inspect(mapper).local_table.name in SHARDED_TABLES:
+                user_id = g.get("shard_user_id")
+                if user_id is None:
+                    raise RuntimeError("No user shard selected for this request")
+                return get_shard_engine(user_id)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={"class_": ShardedSession})
 
 # Models
 class Picture(db.Model):
@@ -20,6 +94,7 @@ class Picture(db.Model):
     timestamp = db.Column(db.DateTime, nullable=False)
     image_path = db.Column(db.String(200), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Add user relationship
+    __table_args__ = (db.Index('ix_picture_user_timestamp', 'user_id', 'timestamp'),)
 
 class SensorData(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -28,6 +103,7 @@ class SensorData(db.Model):
     humidity = db.Column(db.Float, nullable=False)
     soil_humidity = db.Column(db.Float, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Add user relationship
+    __table_args__ = (db.Index('ix_sensor_data_user_timestamp', 'user_id', 'timestamp'),)
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -35,8 +111,47 @@ class User(db.Model):
     password = db.Column(db.String(120), nullable=False)
     germination_date = db.Column(db.DateTime, nullable=True)
     api_key = db.Column(db.String(120), nullable=False)
-    pictures = db.relationship('Picture', backref='user', lazy=True)  # Relationship to pictures
-    sensor_data = db.relationship('SensorData', backref='user', lazy=True)  # Relationship to sensor data
+    # passive_deletes="all": deleting a user never loads these (they may live in another shard); delete_user removes them
+    pictures = db.relationship('Picture', backref='user', lazy=True, passive_deletes="all")  # Relationship to pictures
+    sensor_data = db.relationship('SensorData', backref='user', lazy=True, passive_deletes="all")  # Relationship to sensor data
+
+class AlertRule(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=True)
+    metric = db.Column(db.String(40), nullable=False)  # temperature, humidity or soil_humidity
+    statistic = db.Column(db.String(20), nullable=False, default="value")  # see alerts.Rule
+    operator = db.Column(db.String(10), nullable=False)  # "above" or "below"
+    threshold = db.Column(db.Float, nullable=False)
+    window_minutes = db.Column(db.Integer, nullable=False, default=10)
+    duration_minutes = db.Column(db.Integer, nullable=False, default=0)
+    debounce_minutes = db.Column(db.Integer, nullable=False, default=30)
+    enabled = db.Column(db.Boolean, nullable=False, default=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+class Alert(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    value = db.Column(db.Float, nullable=False)
+    message = db.Column(db.String(300), nullable=False)
+    rule_id = db.Column(db.Integer, db.ForeignKey('alert_rule.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    __table_args__ = (db.Index('ix_alert_user_timestamp', 'user_id', 'timestamp'),)
+
+alert_engine = alerts.AlertEngine()
+
+picture_upload_limiter = limits.TokenBucketLimiter(app.config["PICTURE_UPLOADS_PER_MINUTE"], burst=app.config["PICTURE_UPLOADS_PER_MINUTE"])
+sensor_upload_limiter = limits.TokenBucketLimiter(app.config["SENSOR_UPLOADS_PER_MINUTE"], burst=app.config["SENSOR_UPLOADS_PER_MINUTE"])
+
+# API keys known to belong to a user; loaded at startup and kept in step with the admin endpoints
+known_api_keys = set()
+
+def ingest_limiter_key(api_key):
+    """
+    Returns the token bucket key for an ingest request. Unknown keys all share one bucket,
+    so cycling through junk keys is still limited and cannot evict a real device's bucket.
+    """
+    return api_key if api_key in known_api_keys else None
+image_processing_limiter = limits.ConcurrencyLimiter(app.config["MAX_CONCURRENT_IMAGE_PROCESSING"])
 
 # Helper function to check API key
 def get_user_from_key(api_key):
@@ -48,8 +163,124 @@ def get_user_from_key(api_key):
         return None
         
     user = User.query.filter_by(api_key=api_key).first()
+    if user:
+        known_api_keys.add(api_key)
+        use_shard(user.id)
     return user
 
+def serialize_sensor_data(s):
+    return {
+        "id": s.id,
+        "timestamp": s.timestamp.isoformat(),
+        "temperature": s.temperature,
+        "humidity": s.humidity,
+        "soil_humidity": s.soil_humidity,
+        "user_id": s.user_id
+    }
+
+SENSOR_COLUMNS = ("id", "timestamp", "temperature", "humidity", "soil_humidity")
+
+def sensor_data_columns(rows):
+    """
+    Transposes (id, timestamp, temperature, humidity, soil_humidity) rows into
+    parallel arrays, with timestamps as integer epoch milliseconds. Stored times are the
+    server's local time (datetime.now()), so they are converted as local time.
+    """
+    columns = dict(zip(SENSOR_COLUMNS, (list(c) for c in zip(*rows)))) if rows else {c: [] for c in SENSOR_COLUMNS}
+    columns["timestamp"] = [round(ts.timestamp() * 1000) for ts in columns["timestamp"]]
+    return columns
+
+def load_alert_state(user_id):
+    """
+    Rebuilds the alert engine state for a user from their enabled rules,
+    replaying only the readings inside the longest rule window.
+    """
+    rules = [
+        alerts.Rule(id=r.id, metric=r.metric, statistic=r.statistic, operator=r.operator,
+                    threshold=r.threshold, window_minutes=r.window_minutes,
+                    duration_minutes=r.duration_minutes, debounce_minutes=r.debounce_minutes,
+                    name=r.name or "")
+        for r in AlertRule.query.filter_by(user_id=user_id, enabled=True).all()
+    ]
+    history = []
+    last_fired = {}
+    if rules:
+        since = datetime.now() - alerts.AlertEngine.history_span(rules)
+        history = [
+            (s.timestamp, {"temperature": s.temperature, "humidity": s.humidity, "soil_humidity": s.soil_humidity})
+            for s in SensorData.query.filter(SensorData.user_id == user_id, SensorData.timestamp >= since)
+                .order_by(SensorData.timestamp.asc())
+        ]
+        last_fired = dict(
+            db.session.query(Alert.rule_id, func.max(Alert.timestamp))
+            .filter(Alert.user_id == user_id).group_by(Alert.rule_id).all()
+        )
+    alert_engine.load(user_id, rules, history, last_fired)
+
+latest_states = {}
+latest_states_lock = threading.Lock()
+
+def get_latest_state(user_id):
+    """
+    Returns the in-memory latest state for a user: current JPEG bytes and ETag,
+    newest sensor reading and the timestamp of the last archived picture.
+    Built lazily from disk and the database the first time a user is seen.
+    """
+    state = latest_states.get(user_id)
+    if state is not None:
+        return state
+
+    state = {"image": None, "etag": None, "image_timestamp": None, "reading": None,
+             "last_archived": None, "lock": threading.Lock()}
+    current_image_path = f"uploads/user_{user_id}/current.jpg"
+    if os.path.exists(current_image_path):
+        with open(current_image_path, "rb") as f:
+            state["image"] = f.read()
+        state["etag"] = hashlib.md5(state["image"]).hexdigest()
+        state["image_timestamp"] = datetime.fromtimestamp(os.path.getmtime(current_image_path))
+    latest_reading = SensorData.query.filter_by(user_id=user_id).order_by(SensorData.timestamp.desc()).first()
+    if latest_reading:
+        state["reading"] = serialize_sensor_data(latest_reading)
+    last_picture = Picture.query.filter_by(user_id=user_id).order_by(Picture.timestamp.desc()).first()
+    if last_picture:
+        state["last_archived"] = last_picture.timestamp
+
+    with latest_states_lock:
+        return latest_states.setdefault(user_id, state)
+
+def find_nearest_sensor_data(user_id, timestamps):
+    """
+    Returns the SensorData reading closest in time to each of the given timestamps.
+    Loads the readings spanning the timestamps plus one neighbour on each side
+    (three indexed range queries) and bisects into them, instead of querying per picture.
+    """
+    if not timestamps:
+        return []
+
+    start, end = min(timestamps), max(timestamps)
+    base = SensorData.query.filter_by(user_id=user_id)
+    before = base.filter(SensorData.timestamp < start).order_by(SensorData.timestamp.desc()).first()
+    after = base.filter(SensorData.timestamp > end).order_by(SensorData.timestamp.asc()).first()
+    readings = base.filter(SensorData.timestamp >= start, SensorData.timestamp <= end) \
+        .order_by(SensorData.timestamp.asc()).all()
+    readings = ([before] if before else []) + readings + ([after] if after else [])
+    if not readings:
+        return [None] * len(timestamps)
+
+    reading_times = [r.timestamp for r in readings]
+    nearest = []
+    for ts in timestamps:
+        i = bisect.bisect_left(reading_times, ts)
+        if i == 0:
+            nearest.append(readings[0])
+        elif i == len(readings):
+            nearest.append(readings[-1])
+        elif reading_times[i] - ts < ts - reading_times[i - 1]:
+            nearest.append(readings[i])
+        else:
+            nearest.append(readings[i - 1])
+    return nearest
+
 @app.route("/api/login", methods=["POST"])
 def login():
     try:
@@ -88,6 +319,12 @@ def send_report(path):
 @app.route("/api/upload_picture", methods=["POST"])
 def upload_picture():
     key = request.args.get("key")
+
+    # Checked before the key lookup so a looping device costs no database work
+    wait = picture_upload_limiter.acquire(ingest_limiter_key(key))
+    if wait:
+        return jsonify({"error": "Too many uploads"}), 429, {"Retry-After": limits.retry_after(wait)}
+
     user = get_user_from_key(key)
     
     if not user:
@@ -99,6 +336,10 @@ def upload_picture():
     if not image_base64:
         return jsonify({"error": "Missing image"}), 400
 
+    # Shed rather than queue when the server is already decoding as many images as it allows
+    if not image_processing_limiter.try_acquire():
+        return jsonify({"error": "Server busy"}), 503, {"Retry-After": "5"}
+
     try:
         # Decode the image
         decoded_image = base64.b64decode(image_base64)
@@ -112,15 +353,30 @@ def upload_picture():
         if not os.path.exists(user_uploads_dir):
             os.makedirs(user_uploads_dir)
 
+        # Encode once, then reuse the bytes for current.jpg, the archive and the cache
+        buffer = io.BytesIO()
+        rotated_image.save(buffer, format="JPEG")
+        jpeg = buffer.getvalue()
+
         # Save the image as current.jpg for this user
         current_image_path = f"{user_uploads_dir}/current.jpg"
-        rotated_image.save(current_image_path)
+        with open(current_image_path, "wb") as f:
+            f.write(jpeg)
 
-        # Check if 10 minutes have passed since the last saved picture for this user
-        last_picture = Picture.query.filter_by(user_id=user.id).order_by(Picture.timestamp.desc()).first()
+        state = get_latest_state(user.id)
         timestamp_obj = datetime.now()
 
-        if not last_picture or (timestamp_obj - last_picture.timestamp).total_seconds() > 1740:  # ~29 minutes
+        # Check if ~29 minutes have passed since the last archived picture for this user
+        with state["lock"]:
+            state["image"] = jpeg
+            state["etag"] = hashlib.md5(jpeg).hexdigest()
+            state["image_timestamp"] = timestamp_obj
+            last_archived = state["last_archived"]
+            archive = not last_archived or (timestamp_obj - last_archived).total_seconds() > 1740
+            if archive:
+                state["last_archived"] = timestamp_obj
+
+        if archive:
             # Save the image with a timestamped filename
             day_or_night = "d"
             try:
@@ -133,7 +389,8 @@ def upload_picture():
 
             file_suffix = day_or_night
             file_path = f"{user_uploads_dir}/{timestamp_obj.strftime('%Y%m%d%H%M%S')}_{file_suffix}.jpg"
-            rotated_image.save(file_path)
+            with open(file_path, "wb") as f:
+                f.write(jpeg)
 
             # Save the record to the database
             picture = Picture(timestamp=timestamp_obj, image_path=file_path, user_id=user.id)
@@ -143,8 +400,31 @@ def upload_picture():
         return jsonify({"message": "Picture uploaded successfully"}), 200
 
     except Exception as e:
+        latest_states.pop(user.id, None)  # Rebuild from disk and database on the next request
         return jsonify({"error": str(e)}), 500
 
+    finally:
+        image_processing_limiter.release()
+
+
+@app.route("/api/admin/limits", methods=["GET"])
+def get_limits():
+    key = request.args.get("key")
+    user = get_user_from_key(key)
+    
+    if not user:
+        return jsonify({"error": "Invalid API key"}), 403
+        
+    # Only admin can access this endpoint
+    if user.username != "admin":
+        return jsonify({"error": "Unauthorized access"}), 403
+
+    return jsonify({
+        "picture_uploads": picture_upload_limiter.stats(),
+        "sensor_uploads": sensor_upload_limiter.stats(),
+        "image_processing": image_processing_limiter.stats()
+    }), 200
+
 
 # Example of updating an admin endpoint
 @app.route("/api/admin/users", methods=["GET"])
@@ -176,6 +456,11 @@ def get_users():
 @app.route("/api/upload_sensor_data", methods=["POST"])
 def upload_sensor_data():
     key = request.args.get("key")
+
+    wait = sensor_upload_limiter.acquire(ingest_limiter_key(key))
+    if wait:
+        return jsonify({"error": "Too many uploads"}), 429, {"Retry-After": limits.retry_after(wait)}
+
     user = get_user_from_key(key)
     
     if not user:
@@ -190,6 +475,15 @@ def upload_sensor_data():
     if temperature is None or humidity is None:
         return jsonify({"error": "Missing temperature, humidity, or timestamp"}), 400
 
+    # Coerce here so the cache and alert engine see the same floats the database returns
+    try:
+        temperature = float(temperature)
+        humidity = float(humidity)
+        soil_humidity = float(soil_humidity) if soil_humidity is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "temperature, humidity and soil_humidity must be numbers"}), 400
+
+    user_id = user.id  # Still readable after a failed commit expires the session
     try:
         timestamp_obj = datetime.now()
         sensor_data = SensorData(
@@ -199,12 +493,34 @@ def upload_sensor_data():
             soil_humidity=soil_humidity,
             user_id=user.id  # Assign the user_id
         )
+        # Rebuild alert state before adding the row, so the replayed history excludes it
+        if not alert_engine.is_loaded(user.id):
+            load_alert_state(user.id)
+        state = get_latest_state(user.id)
         db.session.add(sensor_data)
+
+        # Evaluate alert rules against the new reading
+        reading = {"temperature": temperature, "humidity": humidity, "soil_humidity": soil_humidity}
+        for rule, value in alert_engine.evaluate(user.id, timestamp_obj, reading):
+            message = f"{rule.name or rule.metric}: {rule.statistic} of {rule.metric} is {rule.operator} {rule.threshold} ({value:.2f})"
+            print(f"Alert for user {user.id}: {message}")
+            db.session.add(Alert(timestamp=timestamp_obj, value=value, message=message, rule_id=rule.id, user_id=user.id))
+
+        db.session.flush()  # Assigns the id without reloading the row after commit
+        latest_reading = serialize_sensor_data(sensor_data)
         db.session.commit()
+        # Concurrent uploads may commit out of order, so never replace a newer reading
+        with state["lock"]:
+            cached = state["reading"]
+            if cached is None or datetime.fromisoformat(cached["timestamp"]) < timestamp_obj:
+                state["reading"] = latest_reading
 
         return jsonify({"message": "Sensor data uploaded successfully"}), 200
 
     except Exception as e:
+        db.session.rollback()
+        # The engine already counted this reading and any alert it fired; rebuild from what was persisted
+        alert_engine.reset(user_id)
         return jsonify({"error": str(e)}), 500
 
 
@@ -224,12 +540,14 @@ def get_pictures():
     else:
         # Regular users can only see their own data
         query_user_id = user.id
+    use_shard(query_user_id)
 
     limit = request.args.get("limit", default=10, type=int)
     page = request.args.get("page", default=1, type=int)
     timestamp_after = request.args.get("timestamp_after")
     timestamp_before = request.args.get("timestamp_before")
     sort = request.args.get("sort", default="asc")  # "asc" or "desc"
+    include_sensor_data = request.args.get("include_sensor_data", default="false").lower() == "true"
 
     # Base query filtered by user_id
     query = Picture.query.filter_by(user_id=query_user_id)
@@ -256,6 +574,13 @@ def get_pictures():
         {"id": pic.id, "timestamp": pic.timestamp.isoformat(), "image_path": pic.image_path, "user_id": pic.user_id}
         for pic in pictures.items
     ]
+
+    # Attach the reading closest in time to each picture
+    if include_sensor_data:
+        nearest = find_nearest_sensor_data(query_user_id, [pic.timestamp for pic in pictures.items])
+        for item, s in zip(data, nearest):
+            item["nearest_sensor_data"] = serialize_sensor_data(s) if s else None
+
     return jsonify({"pictures": data, "total": pictures.total}), 200
 
 
@@ -275,12 +600,19 @@ def get_sensor_data():
     else:
         # Regular users can only see their own data
         query_user_id = user.id
+    use_shard(query_user_id)
 
     limit = request.args.get("limit", default=10, type=int)
     page = request.args.get("page", default=1, type=int)
     timestamp_after = request.args.get("timestamp_after")
     timestamp_before = request.args.get("timestamp_before")
     sort = request.args.get("sort", default="asc")  # "asc" or "desc"
+    response_format = request.args.get("format", default="rows")  # "rows", "columnar" or "msgpack"
+
+    if response_format not in ("rows", "columnar", "msgpack"):
+        return jsonify({"error": "format must be rows, columnar or msgpack"}), 400
+    if response_format == "msgpack" and msgpack is None:
+        return jsonify({"error": "msgpack format requires the msgpack package on the server"}), 501
 
     # Base query filtered by user_id
     query = SensorData.query.filter_by(user_id=query_user_id)
@@ -301,19 +633,22 @@ def get_sensor_data():
     else:
         query = query.order_by(SensorData.timestamp.asc())
 
+    # Columnar formats: select bare columns and transpose, skipping ORM objects and per-row dicts
+    if response_format != "rows":
+        query = query.with_entities(*(getattr(SensorData, c) for c in SENSOR_COLUMNS))
+        sensor_data = query.paginate(page=page, per_page=limit)
+        payload = {
+            "user_id": query_user_id,
+            "total": sensor_data.total,
+            "sensor_data": sensor_data_columns(sensor_data.items)
+        }
+        if response_format == "msgpack":
+            return Response(msgpack.packb(payload), mimetype="application/x-msgpack"), 200
+        return jsonify(payload), 200
+
     # Pagination
     sensor_data = query.paginate(page=page, per_page=limit)
-    data = [
-        {
-            "id": s.id,
-            "timestamp": s.timestamp.isoformat(),
-            "temperature": s.temperature,
-            "humidity": s.humidity,
-            "soil_humidity": s.soil_humidity,
-            "user_id": s.user_id
-        }
-        for s in sensor_data.items
-    ]
+    data = [serialize_sensor_data(s) for s in sensor_data.items]
     return jsonify({"sensor_data": data, "total": sensor_data.total}), 200
 
 
@@ -325,6 +660,11 @@ def delete_sensor_data(id):
     if not user:
         return jsonify({"error": "Invalid API key"}), 403
 
+    # Admin can address another user's shard
+    target_user_id = request.args.get("user_id", type=int)
+    if target_user_id and user.username == "admin":
+        use_shard(target_user_id)
+
     sensor_data = SensorData.query.get(id)
     if not sensor_data:
         return jsonify({"error": "Sensor data not found"}), 404
@@ -335,6 +675,7 @@ def delete_sensor_data(id):
 
     db.session.delete(sensor_data)
     db.session.commit()
+    latest_states.pop(sensor_data.user_id, None)
     return jsonify({"message": "Sensor data deleted"}), 200
 
 
@@ -346,6 +687,11 @@ def delete_picture(id):
     if not user:
         return jsonify({"error": "Invalid API key"}), 403
 
+    # Admin can address another user's shard
+    target_user_id = request.args.get("user_id", type=int)
+    if target_user_id and user.username == "admin":
+        use_shard(target_user_id)
+
     picture = Picture.query.get(id)
     if not picture:
         return jsonify({"error": "Picture not found"}), 404
@@ -356,9 +702,234 @@ def delete_picture(id):
 
     db.session.delete(picture)
     db.session.commit()
+    latest_states.pop(picture.user_id, None)
     return jsonify({"message": "Picture deleted"}), 200
 
 
+@app.route("/api/alerts/rules", methods=["GET"])
+def get_alert_rules():
+    key = request.args.get("key")
+    user = get_user_from_key(key)
+    
+    if not user:
+        return jsonify({"error": "Invalid API key"}), 403
+
+    # Get target user (either current user or a user specified by admin)
+    target_user_id = request.args.get("user_id", type=int)
+    if target_user_id and user.username == "admin":
+        query_user_id = target_user_id
+    else:
+        query_user_id = user.id
+    use_shard(query_user_id)
+
+    rules = AlertRule.query.filter_by(user_id=query_user_id).all()
+    data = [
+        {
+            "id": r.id,
+            "name": r.name,
+            "metric": r.metric,
+            "statistic": r.statistic,
+            "operator": r.operator,
+            "threshold": r.threshold,
+            "window_minutes": r.window_minutes,
+            "duration_minutes": r.duration_minutes,
+            "debounce_minutes": r.debounce_minutes,
+            "enabled": r.enabled,
+            "user_id": r.user_id
+        }
+        for r in rules
+    ]
+    return jsonify({"rules": data}), 200
+
+
+@app.route("/api/alerts/rules", methods=["POST"])
+def create_alert_rule():
+    key = request.args.get("key")
+    user = get_user_from_key(key)
+    
+    if not user:
+        return jsonify({"error": "Invalid API key"}), 403
+
+    data = request.json
+    target_user_id = data.get("user_id")
+    if target_user_id is not None and user.username == "admin":
+        # The engine and shards are keyed by int id, so reject strings and unknown users
+        if isinstance(target_user_id, bool) or not isinstance(target_user_id, int):
+            return jsonify({"error": "user_id must be an integer"}), 400
+        if not User.query.get(target_user_id):
+            return jsonify({"error": "User not found"}), 404
+        rule_user_id = target_user_id
+    else:
+        rule_user_id = user.id
+    use_shard(rule_user_id)
+
+    metric = data.get("metric")
+    statistic = data.get("statistic", "value")
+    operator = data.get("operator")
+    threshold = data.get("threshold")
+
+    if metric not in alerts.METRICS:
+        return jsonify({"error": f"metric must be one of {', '.join(alerts.METRICS)}"}), 400
+    if statistic not in alerts.STATISTICS:
+        return jsonify({"error": f"statistic must be one of {', '.join(alerts.STATISTICS)}"}), 400
+    if operator not in alerts.OPERATORS:
+        return jsonify({"error": f"operator must be one of {', '.join(alerts.OPERATORS)}"}), 400
+    if threshold is None:
+        return jsonify({"error": "Missing threshold"}), 400
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)):
+        return jsonify({"error": "threshold must be a number"}), 400
+
+    minutes = {}
+    for field, default, minimum in (("window_minutes", 10, 1), ("duration_minutes", 0, 0), ("debounce_minutes", 30, 0)):
+        value = data.get(field, default)
+        if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+            return jsonify({"error": f"{field} must be an integer of at least {minimum}"}), 400
+        minutes[field] = value
+
+    enabled = data.get("enabled", True)
+    if not isinstance(enabled, bool):
+        return jsonify({"error": "enabled must be true or false"}), 400
+
+    try:
+        rule = AlertRule(
+            name=data.get("name"),
+            metric=metric,
+            statistic=statistic,
+            operator=operator,
+            threshold=float(threshold),
+            window_minutes=minutes["window_minutes"],
+            duration_minutes=minutes["duration_minutes"],
+            debounce_minutes=minutes["debounce_minutes"],
+            enabled=enabled,
+            user_id=rule_user_id
+        )
+        db.session.add(rule)
+        db.session.commit()
+        alert_engine.reset(rule_user_id)
+
+        return jsonify({"message": "Alert rule created", "id": rule.id}), 201
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/alerts/rules/<int:id>", methods=["DELETE"])
+def delete_alert_rule(id):
+    key = request.args.get("key")
+    user = get_user_from_key(key)
+    
+    if not user:
+        return jsonify({"error": "Invalid API key"}), 403
+
+    # Admin can address another user's shard
+    target_user_id = request.args.get("user_id", type=int)
+    if target_user_id and user.username == "admin":
+        use_shard(target_user_id)
+
+    rule = AlertRule.query.get(id)
+    if not rule:
+        return jsonify({"error": "Alert rule not found"}), 404
+        
+    # Check if user owns this rule or is admin
+    if rule.user_id != user.id and user.username != "admin":
+        return jsonify({"error": "Unauthorized access"}), 403
+
+    Alert.query.filter_by(rule_id=rule.id).delete()
+    db.session.delete(rule)
+    db.session.commit()
+    alert_engine.reset(rule.user_id)
+    return jsonify({"message": "Alert rule deleted"}), 200
+
+
+@app.route("/api/alerts", methods=["GET"])
+def get_alerts():
+    key = request.args.get("key")
+    user = get_user_from_key(key)
+    
+    if not user:
+        return jsonify({"error": "Invalid API key"}), 403
+
+    # Get target user (either current user or a user specified by admin)
+    target_user_id = request.args.get("user_id", type=int)
+    if target_user_id and user.username == "admin":
+        query_user_id = target_user_id
+    else:
+        query_user_id = user.id
+    use_shard(query_user_id)
+
+    limit = request.args.get("limit", default=10, type=int)
+    page = request.args.get("page", default=1, type=int)
+
+    history = Alert.query.filter_by(user_id=query_user_id) \
+        .order_by(Alert.timestamp.desc()).paginate(page=page, per_page=limit)
+    data = [
+        {
+            "id": a.id,
+            "timestamp": a.timestamp.isoformat(),
+            "value": a.value,
+            "message": a.message,
+            "rule_id": a.rule_id,
+            "user_id": a.user_id
+        }
+        for a in history.items
+    ]
+    return jsonify({"alerts": data, "total": history.total}), 200
+
+
+@app.route("/api/latest", methods=["GET"])
+def get_latest():
+    key = request.args.get("key")
+    user = get_user_from_key(key)
+    
+    if not user:
+        return jsonify({"error": "Invalid API key"}), 403
+
+    # Get target user (either current user or a user specified by admin)
+    target_user_id = request.args.get("user_id", type=int)
+    if target_user_id and user.username == "admin":
+        query_user_id = target_user_id
+    else:
+        query_user_id = user.id
+    use_shard(query_user_id)
+
+    state = get_latest_state(query_user_id)
+    return jsonify({
+        "sensor_data": state["reading"],
+        "last_archived": state["last_archived"].isoformat() if state["last_archived"] else None,
+        "image_etag": state["etag"],
+        "image_timestamp": state["image_timestamp"].isoformat() if state["image_timestamp"] else None,
+        "user_id": query_user_id
+    }), 200
+
+
+@app.route("/api/latest/image", methods=["GET"])
+def get_latest_image():
+    key = request.args.get("key")
+    user = get_user_from_key(key)
+    
+    if not user:
+        return jsonify({"error": "Invalid API key"}), 403
+
+    # Get target user (either current user or a user specified by admin)
+    target_user_id = request.args.get("user_id", type=int)
+    if target_user_id and user.username == "admin":
+        query_user_id = target_user_id
+    else:
+        query_user_id = user.id
+    use_shard(query_user_id)
+
+    state = get_latest_state(query_user_id)
+    if state["image"] is None:
+        return jsonify({"error": "No current image"}), 404
+
+    # Served from memory; clients revalidate with If-None-Match and get 304 while unchanged
+    response = Response(state["image"], mimetype="image/jpeg")
+    response.set_etag(state["etag"])
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
 @app.route("/api/user/preferences", methods=["GET"])
 def get_preferences():
     key = request.args.get("key")
@@ -424,6 +995,7 @@ def get_timelapse_pictures():
     else:
         # Regular users can only see their own data
         query_user_id = user.id
+    use_shard(query_user_id)
 
     start_date = request.args.get("start_date")
 
@@ -499,6 +1071,7 @@ def create_user():
         )
         db.session.add(new_user)
         db.session.commit()
+        known_api_keys.add(api_key)
 
         return jsonify({
             "message": "User created successfully",
@@ -545,11 +1118,15 @@ def update_user(user_id):
     if password:
         target_user.password = password
 
+    old_api_key = target_user.api_key
     if api_key:
         target_user.api_key = api_key
 
     try:
         db.session.commit()
+        if api_key and api_key != old_api_key:
+            known_api_keys.discard(old_api_key)
+            known_api_keys.add(api_key)
         return jsonify({
             "message": "User updated successfully",
             "user": {
@@ -585,8 +1162,26 @@ def delete_user(user_id):
         return jsonify({"error": "User not found"}), 404
 
     try:
+        if not app.config["SHARD_BY_USER"]:
+            # Ids can be reused, so the user's data must not outlive them (shards are archived below)
+            Alert.query.filter_by(user_id=user_id).delete()
+            AlertRule.query.filter_by(user_id=user_id).delete()
+            Picture.query.filter_by(user_id=user_id).delete()
+            SensorData.query.filter_by(user_id=user_id).delete()
+        deleted_api_key = target_user.api_key
         db.session.delete(target_user)
         db.session.commit()
+        known_api_keys.discard(deleted_api_key)
+
+        # Ids can be reused by the next user created, so drop everything cached for this one
+        latest_states.pop(user_id, None)
+        alert_engine.reset(user_id)
+        if app.config["SHARD_BY_USER"]:
+            archive_shard(user_id)
+        # Move the image folder aside too, or the next user with this id would be served its current.jpg
+        user_uploads_dir = f"uploads/user_{user_id}"
+        if os.path.exists(user_uploads_dir):
+            os.rename(user_uploads_dir, f"{user_uploads_dir}.deleted-{datetime.now().strftime('%Y%m%d%H%M%S')}")
         return jsonify({"message": "User deleted successfully"}), 200
 
     except Exception as e:
@@ -655,8 +1250,26 @@ def initialize_once():
     if not initialized:
         print("Performing one-time initialization")
         # Add your initialization logic here
-        db.create_all()
+        if app.config["SHARD_BY_USER"]:
+            # Per-user tables are created in each shard on first use
+            db.metadata.create_all(db.engine, tables=[User.__table__])
+        else:
+            db.create_all()
+            # create_all() skips tables that already exist, so add indexes to older databases too
+            for table in (Picture.__table__, SensorData.__table__):
+                for index in table.indexes:
+                    index.create(db.engine, checkfirst=True)
         initialize_users()
+        known_api_keys.update(api_key for (api_key,) in db.session.query(User.api_key).all())
+        # Warm the alert engine for users with rules from their recent history
+        if app.config["SHARD_BY_USER"]:
+            user_ids = [user_id for (user_id,) in db.session.query(User.id).all()]
+        else:
+            user_ids = [user_id for (user_id,) in db.session.query(AlertRule.user_id).filter_by(enabled=True).distinct()]
+        for user_id in user_ids:
+            use_shard(user_id)
+            if AlertRule.query.filter_by(user_id=user_id, enabled=True).first():
+                load_alert_state(user_id)
         initialized = True
 
     
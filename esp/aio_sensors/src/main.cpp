@@ -27,6 +27,11 @@ const int CALIBRATION_SAMPLES = 10;
 const int CALIBRATION_DELAY_MS = 1000;
 const float DETECTION_THRESHOLD = 0.60;  // 20% of current value indicates watering event (value drops when wet)
 const unsigned long STABILIZATION_TIME = 300000;  // 5 minutes for soil to stabilize
+const unsigned long READING_INTERVAL_MS = 60000;  // 1 minute between readings
+
+// Backoff when the server sheds requests (429/503)
+const unsigned long BACKOFF_BASE_MS = 60000;    // Used when no Retry-After header is sent
+const unsigned long BACKOFF_MAX_MS = 1800000;   // 30 minutes
 
 // Sensor objects
 DHT dht(DHTPIN, DHTTYPE);
@@ -41,6 +46,12 @@ struct {
   int lowestValue = 4095;  // Track lowest value during watering event
 } sensorCalibration;
 
+struct {
+  bool active = false;     // The next loop waits for the backoff instead of the reading interval
+  unsigned long wait = 0;  // Backoff duration in ms
+  int rejections = 0;      // Consecutive 429/503 responses
+} sendBackoff;
+
 // Function declarations
 void setupWiFi();
 void calibrateSoilSensor();
@@ -49,6 +60,7 @@ void detectWateringEvent(int currentReading);
 void saveCalibrationValues();
 void loadCalibrationValues();
 bool sendDataToServer(const JsonDocument& data);
+void scheduleBackoff(int retryAfterSeconds);
 void indicateStatus(int blinks, int duration);
 
 void setup() {
@@ -164,16 +176,22 @@ bool sendDataToServer(const JsonDocument& data) {
   String urlWithKey = String(serverUrl) + "?key=" + apiKey;
   http.begin(urlWithKey);
   http.addHeader("Content-Type", "application/json");
+  const char* headerKeys[] = {"Retry-After"};
+  http.collectHeaders(headerKeys, 1);
   
   String payload;
   serializeJson(data, payload);
   
   int httpResponseCode = http.POST(payload);
-  bool success = httpResponseCode > 0;
+  bool success = httpResponseCode >= 200 && httpResponseCode < 300;
   
   if (success) {
+    sendBackoff.rejections = 0;
     Serial.println("Data sent successfully!");
     Serial.println("Response: " + http.getString());
+  } else if (httpResponseCode == 429 || httpResponseCode == 503) {
+    scheduleBackoff(http.header("Retry-After").toInt());
+    Serial.println("Server busy. HTTP Response code: " + String(httpResponseCode));
   } else {
     Serial.println("Error sending data. HTTP Response code: " + String(httpResponseCode));
   }
@@ -182,6 +200,21 @@ bool sendDataToServer(const JsonDocument& data) {
   return success;
 }
 
+void scheduleBackoff(int retryAfterSeconds) {
+  // Honor Retry-After, else back off exponentially; random jitter keeps a reconnecting fleet from retrying in lockstep
+  sendBackoff.rejections++;
+  unsigned long wait;
+  if (retryAfterSeconds > 0) {
+    wait = min((unsigned long)retryAfterSeconds * 1000UL, BACKOFF_MAX_MS);
+  } else {
+    wait = min(BACKOFF_BASE_MS << min(sendBackoff.rejections - 1, 5), BACKOFF_MAX_MS);
+  }
+  wait += random(0, (long)(wait / 2 + 1));
+  sendBackoff.active = true;
+  sendBackoff.wait = wait;
+  Serial.printf("Retrying in %lu ms\n", wait);
+}
+
 void indicateStatus(int blinks, int duration) {
   for (int i = 0; i < blinks; i++) {
     digitalWrite(LED_STATUS_PIN, HIGH);
@@ -234,5 +267,11 @@ void loop() {
     indicateStatus(1, 100);
   }
   
-  delay(60000);  // 1 minute delay between readings
+  // After a shed upload, wait for the jittered backoff instead of the fixed interval, then send a fresh reading
+  unsigned long nextDelay = READING_INTERVAL_MS;
+  if (sendBackoff.active) {
+    nextDelay = sendBackoff.wait;
+    sendBackoff.active = false;
+  }
+  delay(nextDelay);
 }
\ No newline at end of file
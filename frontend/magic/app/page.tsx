@@ -43,6 +43,7 @@ interface Picture {
   id: number
   timestamp: string
   image_path: string
+  nearest_sensor_data?: SensorData | null
 }
 
 interface Auth {
@@ -76,8 +77,9 @@ export default function Home() {
   const [sensorData, setSensorData] = useState<SensorData[]>([])
   const [selectedPicture, setSelectedPicture] = useState<Picture | null>(CURRENT_IMG)
   const [nearestSensorData, setNearestSensorData] = useState<SensorData | null>(null)
+  const [latestSensorData, setLatestSensorData] = useState<SensorData | null>(null)
   const [carouselApi, setCarouselApi] = useState<CarouselApi>()
-  const [currentTime, setCurrentTime] = useState(Date.now());
+  const [latestImageEtag, setLatestImageEtag] = useState<string | null>(null)
   const itemRefs = useRef<HTMLDivElement[]>([]);
 
   // Load auth state from localStorage when component mounts
@@ -197,6 +199,7 @@ const calculateAbsoluteHumidity = (temperature: number, relativeHumidity: number
       picturesUrl.searchParams.append('timestamp_before', timestamp_before)
       picturesUrl.searchParams.append('limit', ITEMS_PER_PAGE.toString())
       picturesUrl.searchParams.append('sort', 'desc')
+      picturesUrl.searchParams.append('include_sensor_data', 'true')
       
       const picturesRes = await fetch(picturesUrl.toString())
       const picturesData = await picturesRes.json()
@@ -218,6 +221,15 @@ const calculateAbsoluteHumidity = (temperature: number, relativeHumidity: number
         absolute_humidity: calculateAbsoluteHumidity(data.temperature, data.humidity),
       }));
       setSensorData(processedSensorData)
+
+      // Fetch the cached latest reading for the live image
+      const latestUrl = new URL(`${API_BASE}/latest`)
+      latestUrl.searchParams.append('key', auth.apiKey)
+
+      const latestRes = await fetch(latestUrl.toString())
+      const latestData = await latestRes.json()
+      setLatestSensorData(latestData.sensor_data)
+      setLatestImageEtag(latestData.image_etag)
     } catch (error) {
       console.error('Error fetching data:', error)
     }
@@ -239,30 +251,16 @@ const calculateAbsoluteHumidity = (temperature: number, relativeHumidity: number
     itemRefs.current = itemRefs.current.slice(0, pictures.length + 1);
   }, [pictures]);
 
+  // Find nearest sensor data when picture selected (joined server-side for archived pictures)
   useEffect(() => {
-    const intervalId = setInterval(() => {
-      setCurrentTime(Date.now());
-    }, 120000); // refresh every 2 minutes
-  
-    return () => clearInterval(intervalId);
-  }, []);
-
-  // Find nearest sensor data when picture selected
-  useEffect(() => {
-    if (selectedPicture && sensorData.length > 0) {
-
-      let selectedTime = new Date(selectedPicture.timestamp).getTime()
-      if (selectedPicture.id === 0) {
-        selectedTime = new Date().getTime()
-      }
-      const nearest = sensorData.reduce((prev, curr) => {
-        const prevDiff = Math.abs(new Date(prev.timestamp).getTime() - selectedTime)
-        const currDiff = Math.abs(new Date(curr.timestamp).getTime() - selectedTime)
-        return currDiff < prevDiff ? curr : prev
-      })
-      setNearestSensorData(nearest)
+    if (!selectedPicture) return
+    if (selectedPicture.id === 0) {
+      // The live image pairs with the most recent reading
+      setNearestSensorData(latestSensorData)
+    } else {
+      setNearestSensorData(selectedPicture.nearest_sensor_data ?? null)
     }
-  }, [selectedPicture, sensorData])
+  }, [selectedPicture, latestSensorData])
 
   useEffect(() => {
     if (!carouselApi) {
@@ -548,12 +546,14 @@ const calculateAbsoluteHumidity = (temperature: number, relativeHumidity: number
 
                 {activeTab === 'pictures' && (
                   <div className="space-y-6">
-                    {/* Selected picture view */}
+                    {/* Selected picture view; the live image URL only changes with its ETag, so the browser revalidates and gets 304s */}
                     {selectedPicture && (
                       <Card className="overflow-hidden shadow-lg">
                         <div className="aspect-video bg-gray-100">
                           <img
-                            src={`${API_BASE}/${selectedPicture.image_path}`}
+                            src={selectedPicture.id === CURRENT_IMG.id
+                              ? `${API_BASE}/latest/image?key=${auth.apiKey}&v=${latestImageEtag}`
+                              : `${API_BASE}/${selectedPicture.image_path}`}
                             alt="Plant"
                             className="w-full h-full object-cover"
                             style={{ transform: 'rotate(180deg)' }}
@@ -609,7 +609,7 @@ const calculateAbsoluteHumidity = (temperature: number, relativeHumidity: number
                         >
                           <div className="aspect-square bg-gray-100">
                             <img
-                              src={`${API_BASE}/${CURRENT_IMG.image_path}?t=${currentTime}`}
+                              src={`${API_BASE}/latest/image?key=${auth.apiKey}&v=${latestImageEtag}`}
                               alt="Plant"
                               className="w-full h-full object-cover"
                               style={{ transform: 'rotate(180deg)' }}